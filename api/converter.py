@@ -1,31 +1,146 @@
 from markitdown import MarkItDown
-from typing import Dict, Tuple, Optional, List
-from tempfile import NamedTemporaryFile
+from typing import Dict, Tuple, Optional, List, Any
+import io
 import os
 import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 import mimetypes
 from pathlib import Path
-from bs4 import BeautifulSoup
 
-from models import ConversionResult, ConversionMetadata
-from crawler import WebCrawler
+from models import ConversionPages, ConversionMetadata
+from crawler import WebCrawler, PageData
 import tasks
 
+# ページ間の区切り
+PAGE_SEPARATOR = "\n---\n\n"
+
+# プロセス内で共有するMarkItDownのインスタンス
+_MD = MarkItDown()
+
+def _warm_up() -> None:
+    """
+    小さなHTMLを変換し、初回変換時の遅延初期化を事前に済ませる
+    (プロセスプールのワーカー初期化処理としても使用する)
+    """
+    _MD.convert_stream(io.BytesIO(b"<html><body><p>warm-up</p></body></html>"), file_extension=".html")
+
+_warm_up()
+
+# HTML -> Markdown変換(CPUバウンド)を並列実行するプロセスプール (初回使用時に作成)
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_unavailable = False
+
+def _get_executor() -> Optional[ProcessPoolExecutor]:
+    """
+    変換用のプロセスプールを取得する (未作成の場合は作成する)
+    
+    Returns:
+        ProcessPoolExecutor or None: プロセスプール。作成できない環境ではNone
+    """
+    global _executor, _executor_unavailable
+    if _executor is None and not _executor_unavailable:
+        try:
+            # マルチスレッドのサーバープロセスからforkしないようspawnでワーカーを起動する
+            _executor = ProcessPoolExecutor(
+                max_workers=os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_up
+            )
+        except (OSError, ImportError, NotImplementedError) as e:
+            # サーバーレス環境などでプロセスプールを使用できない場合
+            print(f"Process pool is unavailable, falling back to threads: {str(e)}")
+            _executor_unavailable = True
+    return _executor
+
+def _discard_executor() -> None:
+    """壊れたプロセスプールを破棄し、次回の取得時に作り直す"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+def _convert_one(html: str) -> str:
+    """
+    ワーカープロセス内でHTMLをMarkdownに変換する
+    
+    Args:
+        html: HTML内容
+        
+    Returns:
+        str: Markdown内容
+    """
+    stream = io.BytesIO(html.encode('utf-8'))
+    return _MD.convert_stream(stream, file_extension=".html").text_content
+
+async def _convert_all(htmls: List[str]) -> List[Any]:
+    """
+    複数のHTMLをプロセスプールで並列にMarkdownへ変換する
+    ワーカーの異常終了でプールが壊れた場合は作り直して1回だけ再試行し、
+    プールを作成できない場合はスレッドで変換する
+    
+    Args:
+        htmls: HTML内容のリスト
+        
+    Returns:
+        List[Any]: 各HTMLのMarkdown内容、または変換時の例外
+    """
+    loop = asyncio.get_running_loop()
+    results: List[Any] = [None] * len(htmls)
+    pending = list(range(len(htmls)))
+    
+    for _ in range(2):
+        executor = _get_executor()
+        if executor is None:
+            conversions = await asyncio.gather(
+                *[asyncio.to_thread(_convert_one, htmls[i]) for i in pending],
+                return_exceptions=True
+            )
+            for i, conversion in zip(pending, conversions):
+                results[i] = conversion
+            return results
+        
+        # プールが既に壊れている場合はsubmit時点で例外になるため、投入できた分だけ待機する
+        futures = []
+        submit_error: Optional[BrokenProcessPool] = None
+        try:
+            for i in pending:
+                futures.append(loop.run_in_executor(executor, _convert_one, htmls[i]))
+        except BrokenProcessPool as e:
+            submit_error = e
+        conversions = await asyncio.gather(*futures, return_exceptions=True)
+        conversions += [submit_error] * (len(pending) - len(futures))
+        
+        for i, conversion in zip(pending, conversions):
+            results[i] = conversion
+        pending = [i for i, conversion in zip(pending, conversions) if isinstance(conversion, BrokenProcessPool)]
+        if not pending:
+            break
+        _discard_executor()
+    
+    return results
+
+def shutdown_executor() -> None:
+    """変換用のプロセスプールを終了する"""
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+
 class MarkdownConverter:
     """ウェブサイトをMarkdownに変換するクラス"""
     
     def __init__(self):
         """コンバーターの初期化"""
-        self.markitdown = MarkItDown()
+        self.markitdown = _MD
     
     async def convert_website(
         self, 
         url: str, 
         crawl_depth: int = 1, 
-        include_images: bool = True,
+        include_images: bool = False,
         task_id: Optional[str] = None
-    ) -> ConversionResult:
+    ) -> ConversionPages:
         """
         ウェブサイトをクロールしてMarkdownに変換する
         
@@ -36,11 +151,11 @@ class MarkdownConverter:
             task_id: 進捗報告用のタスクID(省略可)
             
         Returns:
-            ConversionResult: 変換結果
+            ConversionPages: ページ単位の変換結果
         """
         # 進捗状況の更新
         if task_id:
-            tasks.update_task_progress(
+            await tasks.update_task_progress(
                 task_id, 
                 10, 
                 "ウェブサイトのクローリングを開始します"
@@ -48,11 +163,15 @@ class MarkdownConverter:
         
         # ウェブサイトのクローリング
         crawler = WebCrawler(url, max_depth=crawl_depth, include_images=include_images)
-        pages, images = await crawler.crawl(task_id)
+        try:
+            pages, images = await crawler.crawl(task_id)
+        finally:
+            # 画像はMarkdownに埋め込まないため、保存した一時ファイルは削除する
+            crawler.cleanup()
         
         # 進捗状況の更新
         if task_id:
-            tasks.update_task_progress(
+            await tasks.update_task_progress(
                 task_id, 
                 75, 
                 "クローリングが完了しました。Markdownに変換します"
@@ -63,14 +182,14 @@ class MarkdownConverter:
         
         # 進捗状況の更新
         if task_id:
-            tasks.update_task_progress(
+            await tasks.update_task_progress(
                 task_id, 
                 90, 
                 "Markdown変換が完了しました"
             )
         
-        # 全てのMarkdownを結合
-        combined_markdown = self._combine_markdown(markdown_contents, url)
+        # ベースURLを先頭にページを並べる (結合は配信時にストリーミングで行う)
+        ordered_pages = self._order_pages(markdown_contents, crawler.base_url)
         
         # サイトのタイトルを取得
         title = crawler.get_title() or "変換されたウェブサイト"
@@ -86,15 +205,15 @@ class MarkdownConverter:
         )
         
         # 結果の作成
-        result = ConversionResult(
+        result = ConversionPages(
             task_id=task_id or "",
-            markdown=combined_markdown,
+            pages=ordered_pages,
             metadata=metadata
         )
         
         # 進捗状況の更新
         if task_id:
-            tasks.update_task_progress(
+            await tasks.update_task_progress(
                 task_id, 
                 95, 
                 "結果を生成しました"
@@ -107,7 +226,7 @@ class MarkdownConverter:
         file_path: str,
         original_filename: str,
         task_id: Optional[str] = None
-    ) -> ConversionResult:
+    ) -> ConversionPages:
         """
         ファイルをMarkdownに変換する
         
@@ -117,12 +236,12 @@ class MarkdownConverter:
             task_id: 進捗報告用のタスクID(省略可)
             
         Returns:
-            ConversionResult: 変換結果
+            ConversionPages: ページ単位の変換結果
         """
         try:
             # 進捗状況の更新
             if task_id:
-                tasks.update_task_progress(
+                await tasks.update_task_progress(
                     task_id, 
                     10, 
                     f"ファイル {original_filename} の変換を開始します"
@@ -133,7 +252,7 @@ class MarkdownConverter:
             
             # 進捗状況の更新
             if task_id:
-                tasks.update_task_progress(
+                await tasks.update_task_progress(
                     task_id, 
                     30, 
                     "ファイルを解析中..."
@@ -145,7 +264,7 @@ class MarkdownConverter:
             
             # 進捗状況の更新
             if task_id:
-                tasks.update_task_progress(
+                await tasks.update_task_progress(
                     task_id, 
                     90, 
                     "Markdown変換が完了しました"
@@ -165,15 +284,15 @@ class MarkdownConverter:
             )
             
             # 結果の作成
-            result = ConversionResult(
+            result = ConversionPages(
                 task_id=task_id or "",
-                markdown=markdown_content,
+                pages=[markdown_content],
                 metadata=metadata
             )
             
             # 進捗状況の更新
             if task_id:
-                tasks.update_task_progress(
+                await tasks.update_task_progress(
                     task_id, 
                     95, 
                     "結果を生成しました"
@@ -193,92 +312,44 @@ class MarkdownConverter:
             # エラーの再スロー
             raise Exception(f"ファイル変換中にエラーが発生しました: {str(e)}")
     
-    async def _convert_pages_to_markdown(self, pages: Dict[str, str]) -> Dict[str, str]:
+    async def _convert_pages_to_markdown(self, pages: Dict[str, PageData]) -> Dict[str, str]:
         """
         複数のHTMLページをMarkdownに変換する
         
         Args:
-            pages: URL -> HTML内容の辞書
+            pages: URL -> ページデータの辞書
             
         Returns:
             Dict[str, str]: URL -> Markdown内容の辞書
         """
         results: Dict[str, str] = {}
         
-        for url, html in pages.items():
-            try:
-                # 一時ファイルにHTMLを書き込む
-                with NamedTemporaryFile(suffix=".html", delete=False) as temp:
-                    temp_path = temp.name
-                    temp.write(html.encode('utf-8'))
-                
-                # MarkItDownを使用してHTMLをMarkdownに変換
-                conversion_result = self.markitdown.convert(temp_path)
-                markdown_content = conversion_result.text_content
-                
-                # ヘッダーにURLを追加
-                page_title = self._extract_title(html) or url
-                markdown_with_url = f"# {page_title}\n\n*元のURL: {url}*\n\n{markdown_content}"
-                
-                results[url] = markdown_with_url
-                
-                # 一時ファイルを削除
-                os.unlink(temp_path)
-                
-            except Exception as e:
+        # 各ページの変換をプロセスプールに振り分けて並列実行
+        conversions = await _convert_all([page.html for page in pages.values()])
+        
+        for (url, page), markdown_content in zip(pages.items(), conversions):
+            if isinstance(markdown_content, Exception):
                 # エラーの場合はシンプルなエラーメッセージを返す
-                results[url] = f"# {url}\n\n*変換中にエラーが発生しました: {str(e)}*\n"
+                results[url] = f"# {url}\n\n*変換中にエラーが発生しました: {str(markdown_content)}*\n"
+                continue
+            
+            # ヘッダーにURLを追加
+            page_title = page.title or page.heading or url
+            results[url] = f"# {page_title}\n\n*元のURL: {url}*\n\n{markdown_content}"
         
         return results
     
-    def _extract_title(self, html: str) -> Optional[str]:
-        """
-        HTMLからタイトルを抽出する
-        
-        Args:
-            html: HTML内容
-            
-        Returns:
-            Optional[str]: タイトルまたはNone
-        """
-        try:
-            soup = BeautifulSoup(html, 'lxml')
-            title_tag = soup.find('title')
-            if title_tag:
-                return title_tag.text.strip()
-            h1_tag = soup.find('h1')
-            if h1_tag:
-                return h1_tag.text.strip()
-        except:
-            pass
-        return None
-    
-    def _combine_markdown(self, markdown_contents: Dict[str, str], base_url: str) -> str:
+    def _order_pages(self, markdown_contents: Dict[str, str], base_url: str) -> List[str]:
         """
-        複数のMarkdownコンテンツを結合する
+        複数のMarkdownコンテンツを表示順に並べる
         
         Args:
             markdown_contents: URL -> Markdown内容の辞書
             base_url: ベースURL
             
         Returns:
-            str: 結合したMarkdown
+            List[str]: 表示順に並べたMarkdown
         """
         # ベースURLのコンテンツを先頭に持ってくる
-        ordered_urls = list(markdown_contents.keys())
-        if base_url in ordered_urls:
-            ordered_urls.remove(base_url)
-            ordered_urls.insert(0, base_url)
-        
-        # 各ページのMarkdownを結合
-        combined = []
-        for url in ordered_urls:
-            content = markdown_contents[url]
-            combined.append(content)
-            combined.append("\n---\n\n")  # ページ区切り
-        
-        # 末尾の区切りを削除
-        if combined and combined[-1] == "\n---\n\n":
-            combined.pop()
-        
-        return "".join(combined)
\ No newline at end of file
+        head = [markdown_contents[base_url]] if base_url in markdown_contents else []
+        return head + [content for url, content in markdown_contents.items() if url != base_url]
\ No newline at end of file
@@ -1,31 +1,152 @@
 import httpx
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
-from typing import List, Set, Dict, Tuple, Optional
+from bs4 import BeautifulSoup, SoupStrainer
+from urllib.parse import urljoin, urldefrag, urlsplit, urlunsplit, parse_qsl, urlencode
+from urllib.robotparser import RobotFileParser
+from typing import List, Set, Dict, Tuple, Optional, AsyncIterator
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+import aiofiles.tempfile
 import asyncio
+import shutil
+import tempfile
+import time
 import tasks
 
+# クロール時の同時リクエスト数
+MAX_CONCURRENCY = 20
+
+# ホストごとの同時リクエスト数
+MAX_CONCURRENCY_PER_HOST = 10
+
+# robots.txtの判定に使用するユーザーエージェント
+ROBOTS_USER_AGENT = "*"
+
+# 画像をディスクに書き込む単位
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+# ホストごとの1秒あたりの最大リクエスト数
+REQUESTS_PER_SECOND = 10
+
+# クローラーが参照するタグのみを解析対象にする
+PAGE_STRAINER = SoupStrainer(['a', 'img', 'title', 'h1'])
+
+@lru_cache(maxsize=8192)
+def _netloc(url: str) -> str:
+    """
+    URLのホスト部分を小文字で取得する (同じURLの繰り返し解析を避けるためキャッシュする)
+    
+    Args:
+        url: 対象のURL
+        
+    Returns:
+        str: 小文字化したホスト部分 (相対URLの場合は空文字)
+    """
+    return urlsplit(url).netloc.lower()
+
+@dataclass
+class PageData:
+    """クロールしたページのデータ"""
+    html: str  # HTML内容
+    title: Optional[str] = None  # <title>のテキスト
+    heading: Optional[str] = None  # 最初の<h1>のテキスト
+
+@dataclass
+class ParsedHTML:
+    """HTMLから抽出した情報"""
+    title: Optional[str]  # <title>のテキスト
+    heading: Optional[str]  # 最初の<h1>のテキスト
+    links: List[str]  # <a>のhref
+    images: List[str]  # <img>のsrc
+
+def _parse_html(html: str) -> ParsedHTML:
+    """
+    HTMLを解析して必要な情報を抽出する
+    (スレッドで実行するため、BeautifulSoupオブジェクトではなく抽出結果のみを返す)
+    
+    Args:
+        html: HTML内容
+        
+    Returns:
+        ParsedHTML: 抽出した情報
+    """
+    soup = BeautifulSoup(html, 'lxml', parse_only=PAGE_STRAINER)
+    title_tag = soup.find('title')
+    h1_tag = soup.find('h1')
+    return ParsedHTML(
+        title=title_tag.text.strip() if title_tag else None,
+        heading=h1_tag.text.strip() if h1_tag else None,
+        links=[link['href'] for link in soup.find_all('a', href=True)],
+        images=[img['src'] for img in soup.find_all('img', src=True)]
+    )
+
+# lxmlの初回解析時の初期化をインポート時に済ませておく
+_parse_html("<html><head><title></title></head></html>")
+
+class RateLimiter:
+    """トークンバケット方式のレート制限クラス"""
+    
+    def __init__(self, requests_per_second: float):
+        """
+        レート制限の初期化
+        
+        Args:
+            requests_per_second: 1秒あたりの最大リクエスト数
+        """
+        self.rate = requests_per_second
+        self.tokens = float(requests_per_second)
+        self.last_refill = time.monotonic()
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self) -> None:
+        """リクエスト1回分のトークンを取得する(不足時は補充まで待機)"""
+        async with self.lock:
+            # 経過時間に応じてトークンを補充
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            
+            if self.tokens < 1:
+                # 1トークン分が貯まるまで待機してから消費する
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 0.0
+                self.last_refill = time.monotonic()
+            else:
+                self.tokens -= 1
+
 class WebCrawler:
     """ウェブサイトクローリングクラス"""
     
-    def __init__(self, base_url: str, max_depth: int = 1, include_images: bool = True):
+    def __init__(self, base_url: str, max_depth: int = 1, include_images: bool = False):
         """
         クローラーの初期化
         
         Args:
             base_url: クロール開始URL
             max_depth: クロールする最大深度
-            include_images: 画像を含めるかどうか
+            include_images: 画像を取得するかどうか (既定では取得しない)
         """
         self.base_url = base_url
         self.max_depth = max_depth
         self.include_images = include_images
-        self.visited_urls: Set[str] = set()
-        self.pages: Dict[str, str] = {}  # URL -> HTML
-        self.images: Dict[str, bytes] = {}  # URL -> 画像データ
-        self.domain = urlparse(base_url).netloc
+        self.visited_urls: Set[str] = set()  # 正規化したURL (重複判定用)
+        self.pages: Dict[str, PageData] = {}  # URL -> ページデータ
+        self.images: Dict[str, Path] = {}  # URL -> 画像の保存先
+        self.image_dir: Optional[str] = None  # 画像を保存する一時ディレクトリ
+        self._seen_images: Set[str] = set()  # 取得を開始した画像URL
+        self.domain = _netloc(self.base_url)
+        self.client: Optional[httpx.AsyncClient] = None  # クロール中に共有するHTTPクライアント
+        self._semaphore: Optional[asyncio.Semaphore] = None  # 同時リクエスト数の制限
+        # ホストごとの同時リクエスト数とリクエストレートの制限
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(MAX_CONCURRENCY_PER_HOST)
+        )
+        self._limiters: Dict[str, RateLimiter] = defaultdict(lambda: RateLimiter(REQUESTS_PER_SECOND))
+        self._robots: Dict[str, RobotFileParser] = {}  # ホスト -> robots.txt
         
-    async def crawl(self, task_id: Optional[str] = None) -> Tuple[Dict[str, str], Dict[str, bytes]]:
+    async def crawl(self, task_id: Optional[str] = None) -> Tuple[Dict[str, PageData], Dict[str, Path]]:
         """
         ウェブサイトをクロールする
         
@@ -33,41 +154,101 @@ class WebCrawler:
             task_id: 進捗報告用のタスクID(省略可)
             
         Returns:
-            Tuple[Dict[str, str], Dict[str, bytes]]: 収集したページと画像
+            Tuple[Dict[str, PageData], Dict[str, Path]]: 収集したページと画像
+            (画像の一時ファイルは使用後にcleanup()で削除すること)
         """
-        # 開始URLから再帰的にクロール
-        await self._crawl_page(self.base_url, 0, task_id)
+        # 画像はメモリに保持せず一時ディレクトリに保存する
+        if self.include_images and self.image_dir is None:
+            self.image_dir = tempfile.mkdtemp(prefix="webtomark-images-")
+        
+        try:
+            # クロール全体で1つのクライアントを共有し、接続(TCP/TLS)を再利用する
+            # HTTP/2対応サーバーでは1つの接続で複数リクエストを多重化する
+            async with httpx.AsyncClient(
+                timeout=10.0,
+                follow_redirects=True,
+                http2=True,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=50)
+            ) as self.client:
+                # 同時リクエスト数を制限するセマフォ
+                self._semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+                
+                # (URL, 深度) のキューを幅優先で処理する
+                queue: asyncio.Queue = asyncio.Queue()
+                self.visited_urls.add(self._normalize_url(self.base_url))
+                queue.put_nowait((self.base_url, 0))
+                
+                workers = [
+                    asyncio.create_task(self._worker(queue, task_id))
+                    for _ in range(MAX_CONCURRENCY)
+                ]
+                
+                # キューが空になるまで待機し、ワーカーを終了させる
+                await queue.join()
+                for _ in workers:
+                    queue.put_nowait(None)
+                await asyncio.gather(*workers)
+        except BaseException:
+            # クロールが中断された場合は保存済みの画像をここで削除する
+            self.cleanup()
+            raise
         
         # 進捗を95%に更新
         if task_id:
-            tasks.update_task_progress(task_id, 95, "クローリングが完了しました")
+            await tasks.update_task_progress(task_id, 95, "クローリングが完了しました")
         
         return self.pages, self.images
     
-    async def _crawl_page(self, url: str, depth: int, task_id: Optional[str] = None) -> None:
+    async def _worker(self, queue: asyncio.Queue, task_id: Optional[str] = None) -> None:
         """
-        再帰的にページをクロールする
+        キューからURLを取り出してクロールするワーカー
+        
+        Args:
+            queue: (URL, 深度) のキュー。Noneを受け取ると終了する
+            task_id: 進捗報告用のタスクID(省略可)
+        """
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                
+                url, depth = item
+                next_urls = await self._crawl_page(url, depth, task_id)
+                
+                # 見つかったリンクを次の深度としてキューに追加
+                # (重複判定は正規化したURLで行い、取得には元のURLを使用する)
+                for next_url in next_urls:
+                    key = self._normalize_url(next_url)
+                    if key not in self.visited_urls:
+                        self.visited_urls.add(key)
+                        queue.put_nowait((next_url, depth + 1))
+            except Exception as e:
+                # ワーカーが停止するとqueue.join()が終わらなくなるため、ログ出力して次に進む
+                print(f"Error in crawler worker: {str(e)}")
+            finally:
+                queue.task_done()
+    
+    async def _crawl_page(self, url: str, depth: int, task_id: Optional[str] = None) -> List[str]:
+        """
+        1ページをクロールし、次にクロールするURLを返す
         
         Args:
             url: クロールするURL
             depth: 現在の深度
             task_id: 進捗報告用のタスクID(省略可)
+            
+        Returns:
+            List[str]: 次の深度でクロールするURL
         """
-        # 深度制限を超えた場合や既に訪問済みの場合はスキップ
-        if depth > self.max_depth or url in self.visited_urls:
-            return
-        
-        # 同じドメイン内のURLのみクロール
-        if not self._is_same_domain(url):
-            return
-        
-        # URLを訪問済みに追加
-        self.visited_urls.add(url)
+        # 同じドメイン内かつrobots.txtで許可されたURLのみクロール
+        if not self._is_same_domain(url) or not await self._is_allowed(url):
+            return []
         
         # 進捗状況の更新 (初期20%から段階的に70%まで)
         if task_id:
             progress = min(20 + int(50 * (depth + 1) / (self.max_depth + 1)), 70)
-            tasks.update_task_progress(
+            await tasks.update_task_progress(
                 task_id, 
                 progress, 
                 f"ページをクロール中: {url} (深度 {depth}/{self.max_depth})"
@@ -75,83 +256,180 @@ class WebCrawler:
         
         try:
             # ページの取得
-            async with httpx.AsyncClient(timeout=10.0, follow_redirects=True) as client:
-                response = await client.get(url)
-                
-                if response.status_code != 200:
-                    return
-                
-                # HTMLコンテンツを保存
-                html_content = response.text
-                self.pages[url] = html_content
-                
-                # 深度が最大に達した場合はリンクの抽出をスキップ
-                if depth == self.max_depth:
-                    return
-                
-                # BeautifulSoupでHTMLを解析
-                soup = BeautifulSoup(html_content, 'lxml')
-                
-                # リンクを抽出して次の深度でクロール
-                links = soup.find_all('a', href=True)
-                next_urls = []
-                
-                for link in links:
-                    next_url = urljoin(url, link['href'])
-                    if next_url not in self.visited_urls and self._is_same_domain(next_url):
-                        next_urls.append(next_url)
-                
-                # 画像を抽出
-                if self.include_images:
-                    await self._extract_images(soup, url, client)
-                
-                # 次のURLを並行してクロール (最大5つまで同時に)
-                tasks_list = []
-                for i in range(0, len(next_urls), 5):
-                    batch = next_urls[i:i+5]
-                    tasks_list.append(asyncio.gather(
-                        *[self._crawl_page(next_url, depth + 1, task_id) for next_url in batch]
-                    ))
-                
-                for task_batch in tasks_list:
-                    await task_batch
-                    
+            async with self._request_slot(url):
+                response = await self.client.get(url)
+            
+            if response.status_code != 200:
+                return []
+            
+            # HTMLを一度だけ解析し、タイトルと共に保存
+            # (解析はイベントループを止めないよう別スレッドで行う)
+            html_content = response.text
+            parsed = await asyncio.to_thread(_parse_html, html_content)
+            self.pages[url] = PageData(
+                html=html_content,
+                title=parsed.title,
+                heading=parsed.heading
+            )
+            
+            # 深度が最大に達した場合はリンクの抽出をスキップ
+            if depth >= self.max_depth:
+                return []
+            
+            # リンクを抽出
+            next_urls = []
+            
+            for href in parsed.links:
+                next_url = urldefrag(urljoin(url, href))[0]
+                if self._is_same_domain(next_url):
+                    next_urls.append(next_url)
+            
+            # 画像を抽出
+            if self.include_images:
+                await self._extract_images(parsed.images, url)
+            
+            return next_urls
+            
         except (httpx.RequestError, httpx.HTTPStatusError, Exception) as e:
             # エラーをログ出力など（実際の実装ではロギングを追加）
             print(f"Error crawling {url}: {str(e)}")
+            return []
     
-    async def _extract_images(self, soup: BeautifulSoup, page_url: str, client: httpx.AsyncClient) -> None:
+    async def _extract_images(self, image_srcs: List[str], page_url: str) -> None:
         """
         ページから画像を抽出する
         
         Args:
-            soup: BeautifulSoupオブジェクト
+            image_srcs: ページ内の<img>のsrc
             page_url: 現在のページURL
-            client: HTTPクライアント
         """
         if not self.include_images:
             return
         
-        images = soup.find_all('img', src=True)
-        for img in images:
-            try:
-                img_url = urljoin(page_url, img['src'])
-                
-                # 既に取得済みの場合はスキップ
-                if img_url in self.images:
-                    continue
-                
-                # 同じドメイン内の画像のみ取得
-                if not self._is_same_domain(img_url):
-                    continue
-                
-                # 画像を取得
-                img_response = await client.get(img_url)
-                if img_response.status_code == 200:
-                    self.images[img_url] = img_response.content
-            except Exception as e:
-                # エラーをログ出力など
-                print(f"Error extracting image {img.get('src', '')}: {str(e)}")
+        # 同じドメイン内の未取得の画像URLを重複なく集める
+        img_urls = {urljoin(page_url, src) for src in image_srcs}
+        img_urls = {
+            img_url for img_url in img_urls
+            if img_url not in self._seen_images and self._is_same_domain(img_url)
+        }
+        self._seen_images.update(img_urls)
+        
+        # 画像を並行して取得
+        await asyncio.gather(
+            *[self._fetch_image(img_url) for img_url in img_urls],
+            return_exceptions=True
+        )
+    
+    async def _fetch_image(self, img_url: str) -> None:
+        """
+        画像を1つ取得する
+        
+        Args:
+            img_url: 画像のURL
+        """
+        try:
+            if not await self._is_allowed(img_url):
+                return
+            
+            async with self._request_slot(img_url):
+                async with self.client.stream('GET', img_url) as img_response:
+                    if img_response.status_code != 200:
+                        return
+                    
+                    # 画像をチャンク単位で一時ファイルに書き込む
+                    async with aiofiles.tempfile.NamedTemporaryFile(
+                        'wb', dir=self.image_dir, delete=False
+                    ) as img_file:
+                        async for chunk in img_response.aiter_bytes(IMAGE_CHUNK_SIZE):
+                            await img_file.write(chunk)
+                    self.images[img_url] = Path(img_file.name)
+        except Exception as e:
+            # エラーをログ出力など
+            print(f"Error extracting image {img_url}: {str(e)}")
+    
+    @asynccontextmanager
+    async def _request_slot(self, url: str) -> AsyncIterator[None]:
+        """
+        全体とホストごとの同時リクエスト数、ホストごとのレート制限を守ってリクエスト枠を確保する
+        
+        Args:
+            url: リクエスト先のURL
+        """
+        host = _netloc(url)
+        async with self._semaphore, self._host_semaphores[host]:
+            await self._limiters[host].acquire()
+            yield
+    
+    async def _is_allowed(self, url: str) -> bool:
+        """
+        robots.txtでクロールが許可されているかを確認する (robots.txtはホストごとに1回だけ取得)
+        
+        Args:
+            url: 確認するURL
+            
+        Returns:
+            bool: 許可されている場合はTrue
+        """
+        parts = urlsplit(url)
+        host = parts.netloc.lower()
+        robots = self._robots.get(host)
+        if robots is None:
+            robots = await self._fetch_robots(f"{parts.scheme}://{parts.netloc}/robots.txt")
+            self._robots[host] = robots
+        return robots.can_fetch(ROBOTS_USER_AGENT, url)
+    
+    async def _fetch_robots(self, robots_url: str) -> RobotFileParser:
+        """
+        robots.txtを取得して解析する
+        (RobotFileParser.readと同様に、401/403は全て拒否、その他の取得失敗は全て許可として扱う)
+        
+        Args:
+            robots_url: robots.txtのURL
+            
+        Returns:
+            RobotFileParser: 解析したrobots.txt
+        """
+        robots = RobotFileParser(robots_url)
+        try:
+            async with self._request_slot(robots_url):
+                response = await self.client.get(robots_url)
+            
+            if response.status_code in (401, 403):
+                robots.disallow_all = True
+            elif response.status_code != 200:
+                robots.allow_all = True
+            else:
+                robots.parse(response.text.splitlines())
+        except httpx.RequestError as e:
+            print(f"Error fetching {robots_url}: {str(e)}")
+            robots.allow_all = True
+        return robots
+    
+    def cleanup(self) -> None:
+        """
+        クロール中に保存した画像の一時ディレクトリを削除する
+        """
+        if self.image_dir:
+            shutil.rmtree(self.image_dir, ignore_errors=True)
+            self.image_dir = None
+        self.images.clear()
+    
+    @staticmethod
+    def _normalize_url(url: str) -> str:
+        """
+        重複判定用にURLを正規化する
+        (フラグメントの除去、クエリのソート、ホスト名の小文字化)
+        正規化したURLは訪問済みの判定キーとしてのみ使用し、取得には使用しない
+        
+        Args:
+            url: 正規化するURL
+            
+        Returns:
+            str: 正規化したURL
+        """
+        parts = urlsplit(url)
+        query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path or '/', query, ''))
     
     def _is_same_domain(self, url: str) -> bool:
         """
@@ -163,8 +441,7 @@ class WebCrawler:
         Returns:
             bool: 同じドメインの場合はTrue
         """
-        parsed_url = urlparse(url)
-        return parsed_url.netloc == self.domain or parsed_url.netloc == ''
+        return _netloc(url) in ('', self.domain)
     
     def get_title(self) -> Optional[str]:
         """
@@ -177,17 +454,8 @@ class WebCrawler:
             return None
         
         # 基本URLのタイトルを取得
-        if self.base_url in self.pages:
-            soup = BeautifulSoup(self.pages[self.base_url], 'lxml')
-            title_tag = soup.find('title')
-            if title_tag:
-                return title_tag.text.strip()
+        if self.base_url in self.pages and self.pages[self.base_url].title:
+            return self.pages[self.base_url].title
         
         # 基本URLがない場合は最初のページのタイトルを使用
-        first_page = next(iter(self.pages.values()))
-        soup = BeautifulSoup(first_page, 'lxml')
-        title_tag = soup.find('title')
-        if title_tag:
-            return title_tag.text.strip()
-            
-        return None
\ No newline at end of file
+        return next(iter(self.pages.values())).title
@@ -1,27 +1,32 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 import uuid
-from typing import Optional, List
+import json
+from typing import Optional, List, AsyncIterator
 import os
 import tempfile
-import shutil
+import aiofiles
 
-from models import ConversionRequest, TaskStatus, ConversionResult
-from converter import MarkdownConverter
+from models import ConversionRequest, TaskStatus, ConversionResult, ConversionMetadata
+from converter import MarkdownConverter, shutdown_executor, PAGE_SEPARATOR
 import tasks
 
 # 環境変数から設定を読み込み
 MAX_CRAWL_DEPTH = int(os.getenv("MAX_CRAWL_DEPTH", "5"))
 
+# アップロードファイルの上限サイズ (10MB) と書き込み単位 (1MB)
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 # CORS用のオリジン設定を環境変数から取得
 # カンマ区切りの文字列から配列に変換（例: "http://localhost:3000,https://example.com"）
-ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
-# ["*"]のままの場合は、すべてのオリジンを許可
-if len(ALLOWED_ORIGINS) == 1 and ALLOWED_ORIGINS[0] == "*":
-    ALLOWED_ORIGINS = ["*"]
-else:
-    # 各URLの前後の空白を削除
-    ALLOWED_ORIGINS = [origin.strip() for origin in ALLOWED_ORIGINS]
+# "*"の場合はすべてのオリジンを許可し、それ以外は各URLの前後の空白を削除（空要素は除外）
+_origins = os.getenv("ALLOWED_ORIGINS", "*")
+ALLOWED_ORIGINS = (
+    ["*"] if _origins.strip() == "*"
+    else [origin.strip() for origin in _origins.split(",") if origin.strip()]
+)
 
 # FastAPIアプリケーションの作成
 app = FastAPI(
@@ -42,6 +47,12 @@ app.add_middleware(
 # Markdownコンバーターのインスタンス作成
 converter = MarkdownConverter()
 
+# サーバー終了時に実行中のタスクの完了を待ってから変換用のプロセスプールを停止
+@app.on_event("shutdown")
+async def on_shutdown():
+    await tasks.wait_for_background_tasks()
+    shutdown_executor()
+
 # 依存関係：クロール深度の検証
 def validate_crawl_depth(request: ConversionRequest):
     if request.options.crawl_depth > MAX_CRAWL_DEPTH:
@@ -90,16 +101,25 @@ async def convert_file(
     task_id: str = Form(...),
 ):
     # ファイルサイズチェック (10MB上限)
-    if file.size and file.size > 10 * 1024 * 1024:
+    if file.size and file.size > MAX_UPLOAD_SIZE:
         raise HTTPException(status_code=400, detail="ファイルサイズは10MB以下にしてください")
     
     # 一時ファイルの作成
+    temp_file_path = None
     try:
         with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
-            # アップロードされたファイルを一時ファイルにコピー
-            shutil.copyfileobj(file.file, temp_file)
             temp_file_path = temp_file.name
         
+        # アップロードされたファイルをチャンク単位で一時ファイルに書き込む
+        # (file.sizeが不明な場合もあるため、上限を超えた時点で中断する)
+        total_size = 0
+        async with aiofiles.open(temp_file_path, 'wb') as out:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                total_size += len(chunk)
+                if total_size > MAX_UPLOAD_SIZE:
+                    raise HTTPException(status_code=400, detail="ファイルサイズは10MB以下にしてください")
+                await out.write(chunk)
+        
         # ファイルを閉じる
         await file.close()
         
@@ -115,23 +135,48 @@ async def convert_file(
         
     except Exception as e:
         # エラー発生時は一時ファイルを削除
-        if 'temp_file_path' in locals() and os.path.exists(temp_file_path):
+        if temp_file_path and os.path.exists(temp_file_path):
             os.unlink(temp_file_path)
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=f"ファイル処理中にエラーが発生しました: {str(e)}")
 
 # タスクのステータスを確認するエンドポイント
 @app.get("/api/tasks/{task_id}/", response_model=TaskStatus)
 async def get_task_status(task_id: str):
-    task_status = tasks.get_task_status(task_id)
+    task_status = await tasks.get_task_status(task_id)
     if not task_status:
         raise HTTPException(status_code=404, detail="指定されたタスクが見つかりません")
     return task_status
 
+# 結果のMarkdownをページ区切り付きで順に出力
+async def _iter_markdown(pages: AsyncIterator[str]) -> AsyncIterator[str]:
+    first = True
+    async for page in pages:
+        if not first:
+            yield PAGE_SEPARATOR
+        first = False
+        yield page
+
+# 結果をConversionResult形式のJSONとして順に出力（Markdown全体を一度に展開しない）
+async def _iter_result_json(
+    task_id: str,
+    metadata: ConversionMetadata,
+    pages: AsyncIterator[str]
+) -> AsyncIterator[str]:
+    encoder = json.JSONEncoder(ensure_ascii=False)
+    yield '{"task_id":' + encoder.encode(task_id) + ',"markdown":"'
+    async for chunk in _iter_markdown(pages):
+        # JSON文字列のエスケープは文字単位なので、チャンクごとにエスケープして連結できる
+        yield encoder.encode(chunk)[1:-1]
+    yield '","metadata":' + metadata.json() + '}'
+
 # 変換結果を取得するエンドポイント
+# Accept: text/markdown の場合はMarkdownをそのままストリーミングで返す
 @app.get("/api/tasks/{task_id}/result/", response_model=ConversionResult)
-async def get_task_result(task_id: str):
+async def get_task_result(task_id: str, request: Request):
     # タスクの状態を確認
-    task_status = tasks.get_task_status(task_id)
+    task_status = await tasks.get_task_status(task_id)
     if not task_status:
         raise HTTPException(status_code=404, detail="指定されたタスクが見つかりません")
     
@@ -143,11 +188,17 @@ async def get_task_result(task_id: str):
         )
     
     # 結果を取得
-    result = tasks.get_task_result(task_id)
-    if not result:
+    metadata = await tasks.get_task_metadata(task_id)
+    if not metadata:
         raise HTTPException(status_code=404, detail="指定されたタスクの結果が見つかりません")
     
-    return result
+    pages = tasks.iter_task_pages(task_id)
+    if "text/markdown" in request.headers.get("accept", ""):
+        return StreamingResponse(_iter_markdown(pages), media_type="text/markdown; charset=utf-8")
+    return StreamingResponse(
+        _iter_result_json(task_id, metadata, pages),
+        media_type="application/json"
+    )
 
 # サーバーレス環境（Vercel）での起動ポイント
 # VercelのPython runtime向けにこの形式が必要
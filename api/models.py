@@ -1,12 +1,12 @@
 from pydantic import BaseModel, Field, HttpUrl, validator
-from typing import Optional, Dict, Any, Literal
+from typing import Optional, Dict, Any, List, Literal
 from datetime import datetime
-import re
+from urllib.parse import urlsplit
 
 class ConversionOptions(BaseModel):
     """変換オプション用のモデル"""
     crawl_depth: int = Field(1, ge=1, le=5, description="クロールする深さ（1〜5）")
-    include_images: bool = Field(True, description="画像を含めるかどうか")
+    include_images: bool = Field(False, description="画像を取得するかどうか（既定では取得しない）")
 
 class ConversionRequest(BaseModel):
     """変換リクエスト用のモデル"""
@@ -16,20 +16,23 @@ class ConversionRequest(BaseModel):
     
     @validator('url')
     def validate_url(cls, value):
-        # URLの基本的な検証
-        url_pattern = re.compile(
-            r'^(https?://)?' # http:// または https://
-            r'([A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+' # ドメイン
-            r'[A-Za-z0-9][A-Za-z0-9-]{0,61}[A-Za-z0-9]' # TLD
-            r'(/[-A-Za-z0-9+&@#/%?=~_|!:,.;]*)*' # パス
-            r'(\?[-A-Za-z0-9+&@#/%=~_|!:,.;]*)?'  # クエリパラメータ
-        )
-        if not url_pattern.match(value):
-            raise ValueError("無効なURL形式です")
-        
         # URLスキームが省略されている場合、httpsを追加
         if not value.startswith(('http://', 'https://')):
             value = 'https://' + value
+        
+        # URLの基本的な検証 (スキームとホスト名の構造のみ確認)
+        try:
+            parts = urlsplit(value)
+            hostname = parts.hostname
+        except ValueError:
+            raise ValueError("無効なURL形式です")
+        if not hostname or '.' not in hostname or any(c.isspace() for c in value):
+            raise ValueError("無効なURL形式です")
+
+        # ホスト名の各ラベルが空でなく、英数字を含むことを確認する
+        labels = hostname.split('.')
+        if not all(labels) or not all(any(c.isalnum() for c in label) for label in labels):
+            raise ValueError("無効なURL形式です")
             
         return value
 
@@ -54,4 +57,10 @@ class ConversionResult(BaseModel):
     """変換結果用のモデル"""
     task_id: str
     markdown: str
+    metadata: ConversionMetadata
+
+class ConversionPages(BaseModel):
+    """ページ単位の変換結果用のモデル（結果の保存・ストリーミング配信用）"""
+    task_id: str
+    pages: List[str]  # 各ページのMarkdown（表示順）
     metadata: ConversionMetadata
\ No newline at end of file
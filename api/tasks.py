@@ -1,13 +1,81 @@
-from typing import Dict, Optional, Callable, Any
+from typing import Dict, Set, Tuple, Optional, Callable, Any, AsyncIterator
 import asyncio
+import os
 import time
-from models import TaskStatus, ConversionResult
+import redis.asyncio as redis
+from models import TaskStatus, ConversionPages, ConversionMetadata
 
-# インメモリタスク状態管理
-# Vercelの関数実行時間制限(30秒)を考慮した簡易実装
-# 実運用では永続化ストレージ(例：Vercel KV)を検討すべき
-tasks: Dict[str, TaskStatus] = {}
-results: Dict[str, ConversionResult] = {}
+# Redis(Vercel KV)によるタスク状態管理
+# 複数プロセス間でタスクを共有し、TTLで古いタスクと結果を自動削除する
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+TASK_TTL_SECONDS = int(os.getenv("TASK_TTL_SECONDS", "1800"))
+
+# 結果のページをRedisから一度に読み出す件数
+RESULT_PAGE_BATCH = 16
+
+redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+
+# タスクが存在する場合のみフィールドを更新するスクリプト
+# (EXISTSとHSETの間にキーが期限切れになり、TTLなしで再作成されるのを防ぐ)
+_HSET_IF_EXISTS = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('HSET', KEYS[1], unpack(ARGV))
+end
+return 0
+""")
+
+# 同じ進捗率での更新を間引く間隔(秒)
+PROGRESS_UPDATE_INTERVAL = 0.25
+
+# タスクID -> 最後に反映した (進捗率, 時刻)
+_last_progress: Dict[str, Tuple[int, float]] = {}
+
+# 実行中のバックグラウンドタスク (GCによる途中終了を防ぐため参照を保持する)
+_background_tasks: Set[asyncio.Task] = set()
+
+def _task_key(task_id: str) -> str:
+    """タスク状態のRedisキー"""
+    return f"task:{task_id}"
+
+def _result_key(task_id: str) -> str:
+    """タスク結果(メタデータ)のRedisキー"""
+    return f"result:{task_id}"
+
+def _result_pages_key(task_id: str) -> str:
+    """タスク結果(ページ単位のMarkdown)のRedisキー"""
+    return f"result:{task_id}:pages"
+
+async def _save_task_status(task_status: TaskStatus) -> None:
+    """
+    タスクの状態をRedisに保存する
+    
+    Args:
+        task_status: 保存するタスクの状態
+    """
+    key = _task_key(task_status.task_id)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(key)
+        pipe.hset(key, mapping=task_status.dict(exclude_none=True))
+        pipe.expire(key, TASK_TTL_SECONDS)
+        await pipe.execute()
+
+async def _save_task_result(task_id: str, result: ConversionPages) -> None:
+    """
+    タスクの結果をRedisに保存する
+    メタデータとページ単位のMarkdownを分けて保存し、配信時にページごとに読み出せるようにする
+    
+    Args:
+        task_id: タスクID
+        result: ページ単位の変換結果
+    """
+    pages_key = _result_pages_key(task_id)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.set(_result_key(task_id), result.metadata.json(), ex=TASK_TTL_SECONDS)
+        pipe.delete(pages_key)
+        if result.pages:
+            pipe.rpush(pages_key, *result.pages)
+            pipe.expire(pages_key, TASK_TTL_SECONDS)
+        await pipe.execute()
 
 async def run_task(
     task_id: str, 
@@ -25,51 +93,53 @@ async def run_task(
     """
     try:
         # タスク状態を処理中に更新
-        tasks[task_id] = TaskStatus(
+        await _save_task_status(TaskStatus(
             task_id=task_id,
             status="processing",
             progress=10,
             message="タスクを開始しました"
-        )
+        ))
         
         # 関数実行
         result = await func(*args, **kwargs, task_id=task_id)
         
         # 結果を保存
-        results[task_id] = result
+        await _save_task_result(task_id, result)
         
         # タスク状態を完了に更新
-        tasks[task_id] = TaskStatus(
+        await _save_task_status(TaskStatus(
             task_id=task_id,
             status="completed",
             progress=100,
             message="タスクが完了しました"
-        )
+        ))
         
     except Exception as e:
         # エラー時の状態更新
-        tasks[task_id] = TaskStatus(
+        await _save_task_status(TaskStatus(
             task_id=task_id,
             status="failed",
             progress=0,
             message=f"エラーが発生しました: {str(e)}"
-        )
+        ))
+    finally:
+        _last_progress.pop(task_id, None)
 
-def create_task(task_id: str) -> None:
+async def create_task(task_id: str) -> None:
     """
     新しいタスクを作成する
     
     Args:
         task_id: タスクID
     """
-    tasks[task_id] = TaskStatus(
+    await _save_task_status(TaskStatus(
         task_id=task_id,
         status="pending",
         progress=0,
         message="タスクを作成しました"
-    )
+    ))
 
-def get_task_status(task_id: str) -> Optional[TaskStatus]:
+async def get_task_status(task_id: str) -> Optional[TaskStatus]:
     """
     タスクの状態を取得する
     
@@ -79,21 +149,47 @@ def get_task_status(task_id: str) -> Optional[TaskStatus]:
     Returns:
         TaskStatus or None: タスクの状態または存在しない場合はNone
     """
-    return tasks.get(task_id)
+    data = await redis_client.hgetall(_task_key(task_id))
+    if not data:
+        return None
+    return TaskStatus(**data)
 
-def get_task_result(task_id: str) -> Optional[ConversionResult]:
+async def get_task_metadata(task_id: str) -> Optional[ConversionMetadata]:
     """
-    タスクの結果を取得する
+    タスク結果のメタデータを取得する
     
     Args:
         task_id: タスクID
     
     Returns:
-        ConversionResult or None: タスクの結果または存在しない場合はNone
+        ConversionMetadata or None: 結果のメタデータまたは存在しない場合はNone
     """
-    return results.get(task_id)
+    data = await redis_client.get(_result_key(task_id))
+    if not data:
+        return None
+    return ConversionMetadata.parse_raw(data)
 
-def update_task_progress(task_id: str, progress: int, message: Optional[str] = None) -> None:
+async def iter_task_pages(task_id: str) -> AsyncIterator[str]:
+    """
+    タスク結果のMarkdownをページ単位で順に読み出す
+    
+    Args:
+        task_id: タスクID
+    
+    Yields:
+        str: 各ページのMarkdown
+    """
+    pages_key = _result_pages_key(task_id)
+    start = 0
+    while True:
+        pages = await redis_client.lrange(pages_key, start, start + RESULT_PAGE_BATCH - 1)
+        for page in pages:
+            yield page
+        if len(pages) < RESULT_PAGE_BATCH:
+            return
+        start += RESULT_PAGE_BATCH
+
+async def update_task_progress(task_id: str, progress: int, message: Optional[str] = None) -> None:
     """
     タスクの進捗状況を更新する
     
@@ -102,11 +198,22 @@ def update_task_progress(task_id: str, progress: int, message: Optional[str] = N
         progress: 進捗率(0-100)
         message: 進捗メッセージ(省略可)
     """
-    if task_id in tasks:
-        task = tasks[task_id]
-        task.progress = progress
-        if message:
-            task.message = message
+    # 進捗率が変わらず、前回の更新から間もない場合は反映しない
+    now = time.monotonic()
+    last = _last_progress.get(task_id)
+    if last and last[0] == progress and now - last[1] < PROGRESS_UPDATE_INTERVAL:
+        return
+    _last_progress[task_id] = (progress, now)
+    
+    fields = ["progress", progress]
+    if message:
+        fields += ["message", message]
+    
+    # 進捗の反映は補助的な処理のため、Redisのエラーで変換処理を止めない
+    try:
+        await _HSET_IF_EXISTS(keys=[_task_key(task_id)], args=fields, client=redis_client)
+    except redis.RedisError as e:
+        print(f"Error updating progress for task {task_id}: {str(e)}")
 
 async def start_background_task(
     task_id: str, 
@@ -123,16 +230,15 @@ async def start_background_task(
         *args, **kwargs: 関数に渡す引数
     """
     # 新しいタスクを作成
-    create_task(task_id)
+    await create_task(task_id)
     
-    # バックグラウンドでタスクを実行
-    asyncio.create_task(run_task(task_id, func, *args, **kwargs))
+    # バックグラウンドでタスクを実行 (完了するまで参照を保持)
+    task = asyncio.create_task(run_task(task_id, func, *args, **kwargs))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
 
-# 古いタスクを自動クリーンアップ (オプション)
-def cleanup_old_tasks():
+async def wait_for_background_tasks() -> None:
     """
-    30分以上経過した古いタスクと結果を削除する
-    実運用では別途実装が必要
+    実行中のバックグラウンドタスクが全て終了するまで待機する
     """
-    # このサンプル実装では何もしない (Vercelサーバーレス環境では不要)
-    pass
\ No newline at end of file
+    await asyncio.gather(*_background_tasks, return_exceptions=True)